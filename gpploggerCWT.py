@@ -13,9 +13,9 @@ v1.2  (compact freq-selector, visible version label)
 __version__ = "v1.2"
 
 # ──── stdlib ─────────────────────────────────────────────────────
-import csv, math, time, threading, datetime as dt, sys
+import math, os, queue, time, threading, traceback, datetime as dt, sys
 from pathlib import Path
-from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import tkinter as tk
 from tkinter import ttk, messagebox
 
@@ -40,11 +40,22 @@ VSET        = 5.0
 WINDOW_H    = 48.0                    # hours shown
 EXCEL_INT_H = 1.0                     # h
 MAX_POINTS  = 20_000
+CSV_BUF     = 1 << 16                 # raw.csv write buffer (bytes)
+FLUSH_S     = 60                      # max seconds of rows held unflushed
+ROW_FMT     = "%s,%.4f,%s,%s,%s,%s\n"  # time,rel_h,R1..R4 (no quoting needed)
 Y_MIN_DFLT, Y_MAX_DFLT = 8.0, 15.0
 FREQ_OPTIONS = [("5 s", 5), ("15 s", 15), ("30 s", 30),
                 ("1 min", 60), ("5 min", 300)]
 LOG_DIR = Path.home() / "gpp_logs"; LOG_DIR.mkdir(exist_ok=True)
 RAW_CSV = LOG_DIR / "raw.csv"
+XLSX_PATH = LOG_DIR / "xlsx.path"           # sidecar: current Excel target
+CHAN_LABELS = ("R1","R2","R3","R4")
+CHAN_COL_LETTERS = [xlsxwriter.utility.xl_col_to_name(c)   # Data sheet cols
+                    for c in range(2,2+len(CHAN_LABELS))]
+MPL_EPOCH = dt.datetime.fromisoformat(mdates.get_epoch())   # date-num day 0
+matplotlib.rcParams.update({"path.simplify":True,           # cheaper long lines
+                            "path.simplify_threshold":1.0,
+                            "agg.path.chunksize":10000})
 
 # ──── VISA helpers ───────────────────────────────────────────────
 def open_psu():
@@ -53,6 +64,7 @@ def open_psu():
     psu.baud_rate, psu.data_bits = BAUD, 8
     psu.stop_bits, psu.parity    = C.StopBits.one, C.Parity.none
     psu.write_termination, psu.read_termination = "\r\n", "\n"
+    psu.chunk_size = 20480                    # one read() per reply
     psu.write("SYST:REM"); return psu
 
 def chan_on(psu, ch, ilim):
@@ -62,19 +74,32 @@ def chan_on(psu, ch, ilim):
 
 def chan_off(psu, ch): psu.write(f":OUTP{ch}:STAT OFF")
 
-def safe_R(psu, ch):
-    try:
-        v,i,_ = map(float, psu.query(f":MEAS{ch}:ALL?").split(","))
-        return np.inf if abs(i)<1e-6 else v/i
-    except Exception: return np.nan
+def safe_R(psu, chans):
+    """R of channels 1-4 from one compound query; NaN where not polled/failed."""
+    out=np.full(4,np.nan)
+    if not chans: return out
+    try: reply=psu.query(";".join(f":MEAS{ch}:ALL?" for ch in chans))
+    except Exception: return out
+    try: arr=np.fromstring(reply.replace(";",","),sep=",")  # V,I,P per channel
+    except ValueError: return out                       # garbled reply
+    if arr.size!=3*len(chans): return out
+    v,i=arr[0::3],arr[1::3]
+    # no current (open circuit) -> inf, without dividing by ~0
+    out[np.asarray(chans)-1]=np.divide(v,i,out=np.full_like(v,np.inf),
+                                       where=np.abs(i)>=1e-6)
+    return out
+
+def datenum(ts):
+    """mdates.date2num for a naive datetime without the generic dispatch."""
+    return (ts-MPL_EPOCH).total_seconds()/86400
 
 # ──── CSV / Excel helpers ────────────────────────────────────────
 def ensure_raw():
     if RAW_CSV.exists():
         return
+    XLSX_PATH.unlink(missing_ok=True)         # a new log gets a new workbook
     with RAW_CSV.open("w", newline="") as f:
-        f.write("#xlsx:\n")
-        csv.writer(f).writerow(["time","rel_h","R1","R2","R3","R4"])
+        f.write(",".join(("time","rel_h",*CHAN_LABELS))+"\n")
 
 def prompt_existing_csv():
     if not RAW_CSV.exists() or RAW_CSV.stat().st_size == 0:
@@ -95,35 +120,49 @@ def prompt_existing_csv():
         RAW_CSV.unlink()
 
 def current_xlsx():
-    with RAW_CSV.open() as f:
-        first=f.readline().strip()
-    return Path(first[6:]) if first.startswith("#xlsx:") and first[6:] else None
+    try:
+        first=XLSX_PATH.read_text().strip()
+    except FileNotFoundError:                 # older logs: "#xlsx:" header line
+        with RAW_CSV.open() as f:
+            first=f.readline().strip()
+        first=first[6:] if first.startswith("#xlsx:") else ""
+    return Path(first) if first else None
 
 def set_xlsx(path: Path):
-    tmp = RAW_CSV.with_suffix(".tmp")
-    with RAW_CSV.open() as fin, tmp.open("w") as fout:
-        fout.write(f"#xlsx:{path}\n"); next(fin)
-        for ln in fin: fout.write(ln)
-    tmp.replace(RAW_CSV)
+    tmp = XLSX_PATH.with_suffix(".tmp")
+    tmp.write_text(f"{path}\n")
+    tmp.replace(XLSX_PATH)
 
 def csv_to_xlsx(csv_path: Path, xlsx_path: Path):
-    with csv_path.open() as f:
-        rows=[r.rstrip("\n").split(",") for r in f if not r.startswith("#")]
-    wb=xlsxwriter.Workbook(xlsx_path)
+    wb=xlsxwriter.Workbook(xlsx_path,{"constant_memory":True})
     ws_d,ws_c=wb.add_worksheet("Data"),wb.add_worksheet("Chart")
     chart=wb.add_chart({"type":"line"})
-    for r,row in enumerate(rows):
-        for c,val in enumerate(row):
-            if r==0: ws_d.write(r,c,val)
-            elif val and (c==0 or math.isfinite(float(val))):
-                ws_d.write(r,c,val if c==0 else float(val))
-    max_row=len(rows)-1
-    for col,label in enumerate(("R1","R2","R3","R4"),2):
-        if any(rows[r][col] for r in range(1,len(rows))):
-            col_letter=xlsxwriter.utility.xl_col_to_name(col)
+    has_data=[False]*len(CHAN_LABELS)
+    r=-1
+    with csv_path.open() as f:
+        for line in f:                      # stream: rows written in order
+            if line.startswith("#"): continue
+            if not line.endswith("\n"): break  # row still being written
+            r+=1
+            row=line.rstrip("\n").split(",")
+            if r==0:
+                for c,val in enumerate(row): ws_d.write_string(r,c,val)
+                continue
+            for c,val in enumerate(row):
+                if not val: continue
+                if c==0: ws_d.write_string(r,c,val); continue
+                try: fv=float(val)
+                except ValueError: continue
+                if not math.isfinite(fv): continue
+                ws_d.write_number(r,c,fv)
+                if c>=2: has_data[c-2]=True
+    max_row=r
+    categories=f"=Data!$B$2:$B${max_row+1}"
+    for label,col_letter,used in zip(CHAN_LABELS,CHAN_COL_LETTERS,has_data):
+        if used:
             chart.add_series({
                 "name":label,
-                "categories":f"=Data!$B$2:$B${max_row+1}",
+                "categories":categories,
                 "values":   f"=Data!${col_letter}$2:${col_letter}${max_row+1}",
             })
     chart.set_x_axis({"name":"Hours from start"})
@@ -131,6 +170,13 @@ def csv_to_xlsx(csv_path: Path, xlsx_path: Path):
     ws_c.insert_chart("B2", chart, {"x_scale":1.5,"y_scale":1.3})
     wb.close()
 
+def report_failure(fut):
+    """Done-callback: print the traceback of a failed background xlsx build."""
+    e=fut.exception()
+    if e is not None:
+        print("Hourly xlsx export failed:", file=sys.stderr)
+        traceback.print_exception(type(e), e, e.__traceback__)
+
 # ──── GUI class ────────────────────────────────────────────────────
 class App(tk.Tk):
     def __init__(self):
@@ -180,6 +226,9 @@ class App(tk.Tk):
         # freq selector
         ttk.Label(ctrl,text="Log every:").grid(row=0,column=5,sticky="e")
         self.sample_int=tk.IntVar(value=5)
+        # plain-int mirror for the worker thread (Tk vars are main-thread only)
+        self._period=self.sample_int.get()
+        self.sample_int.trace_add("write",self._on_period)
         freq_frame=ttk.Frame(ctrl); freq_frame.grid(row=0,column=6,columnspan=3,sticky="w")
         for lbl,val in FREQ_OPTIONS:
             ttk.Radiobutton(freq_frame,text=lbl,variable=self.sample_int,
@@ -199,28 +248,41 @@ class App(tk.Tk):
         fig,self.ax=plt.subplots(figsize=(8,5))
         self.ax.set_xlabel("time"); self.ax.set_ylabel("R (Ω)")
         self.ax.set_ylim(Y_MIN_DFLT,Y_MAX_DFLT)
+        self.ax.set_autoscale_on(False)         # limits are always set explicitly
         self.ax.xaxis.set_major_formatter(mdates.DateFormatter("%d-%b\n%H:%M"))
         fig.subplots_adjust(left=0.05,right=0.75,top=0.97,bottom=0.3)
         self.lines=[self.ax.plot([],[],label=f"CH{i}")[0] for i in range(1,5)]
         self.leg=self.ax.legend(loc="center left",
                                 bbox_to_anchor=(1,0.5),fontsize=16)
         self.canvas=FigureCanvasTkAgg(fig,master=self)
+        self._shown_i0=None                     # window start last drawn
         self.canvas.get_tk_widget().grid(row=2,column=0,sticky="nsew",
                                          padx=8,pady=4)
 
         # runtime
         prompt_existing_csv()
         ensure_raw()
-        self.t,self.r=self._load_cache()
+        self.t=np.empty(MAX_POINTS); self.r=np.empty((4,MAX_POINTS))
+        self.head=self.count=0                  # ring-buffer write pos / fill
+        self._t_cache=self._r_cache=None; self._cache_dirty=True
+        self.seq=self._seq0=0                   # samples ever appended / of cache[0]
+        self._load_cache()
         self.psu=None; self.mode=None
         self.thread=None; self.stop_evt=threading.Event()
+        self.xlsx_pool=ThreadPoolExecutor(max_workers=1)  # serialises xlsx builds
         self.after_id=None; self.next_xlsx=None; self.t0=None
+        self._excel_path=None; self.worker_err=None
+        self._q=self._wr=None                   # writer queue/thread of a run
         self.redraw()
 
     # helpers
     def _toggle_full(self):
         self.full=not self.full; self.attributes("-fullscreen",self.full)
 
+    def _on_period(self,*_):
+        try: self._period=self.sample_int.get()
+        except tk.TclError: pass
+
     def _bump(self,name,d):
         try:v=getattr(self,name).get()+d; getattr(self,name).set(round(v,3))
         except tk.TclError: pass
@@ -231,58 +293,141 @@ class App(tk.Tk):
         self.ax.set_ylim(ymin,ymax); self.canvas.draw_idle()
 
     def _load_cache(self):
-        t=deque(maxlen=MAX_POINTS)
-        r=[deque(maxlen=MAX_POINTS) for _ in range(4)]
+        # keep only complete data rows (a crash can leave a partial last line)
         with RAW_CSV.open() as f:
-            rdr=csv.reader(l for l in f if not l.startswith("#"))
-            next(rdr,None)
-            for row in rdr:
-                t.append(mdates.datestr2num(row[0]))
-                for i,val in enumerate(row[2:6]):
-                    r[i].append(float(val) if val else np.nan)
-        return t,r
+            lines=[l for l in f if l[:1] not in ("#","t") and l.count(",")==5]
+        lines=lines[-MAX_POINTS:]
+        if not lines: return
+        arr=np.loadtxt(lines,delimiter=",",dtype=str,ndmin=2)  # parsed in C
+        vals=arr[:,2:6]; vals=np.where(vals=="","nan",vals).astype(float)
+        vals[np.isinf(vals)]=np.nan             # open circuit: hidden in plot
+        n=len(arr)
+        secs=(arr[:,0].astype("datetime64[s]")-np.datetime64(MPL_EPOCH,"s"))
+        self.t[:n]=secs.astype(float)/86400
+        self.r[:,:n]=vals.T
+        self.head,self.count=n%MAX_POINTS,n; self.seq=n
+
+    def _excel(self):
+        if self._excel_path is None:
+            excel=current_xlsx()
+            if excel is None:
+                excel=LOG_DIR/f"gpp_{dt.datetime.now():%Y%m%d_%H%M%S}.xlsx"
+                set_xlsx(excel)
+            self._excel_path=excel
+        return self._excel_path
+
+    # ring buffer -------------------------------------------------------------
+    def _append(self,tnum,vals):
+        """Store one sample; infinite R (open circuit) is kept as NaN."""
+        h=self.head
+        self.t[h]=tnum; self.r[:,h]=vals
+        self.r[np.isinf(self.r[:,h]),h]=np.nan
+        self.head=(h+1)%MAX_POINTS; self.count=min(self.count+1,MAX_POINTS)
+        self.seq+=1; self._cache_dirty=True
+
+    def _series(self):
+        """Return (t, r, fresh) in chronological order; (t, r) are rebuilt only
+        after an append, and fresh tells whether that happened on this call."""
+        fresh=self._cache_dirty
+        if fresh:
+            self._cache_dirty=False           # clear first: appends may race
+            n,h=self.count,self.head; self._seq0=self.seq-n
+            if n<MAX_POINTS or h==0:
+                self._t_cache,self._r_cache=self.t[:n],self.r[:,:n]
+            else:
+                self._t_cache=np.concatenate((self.t[h:],self.t[:h]))
+                self._r_cache=np.concatenate((self.r[:,h:],self.r[:,:h]),axis=1)
+        return self._t_cache,self._r_cache,fresh
 
     # worker -----------------------------------------------------------------
     def worker(self,chans,ilim):
-        excel=current_xlsx()
-        if excel is None:
-            excel=LOG_DIR/f"gpp_{dt.datetime.now():%Y%m%d_%H%M%S}.xlsx"
-            set_xlsx(excel)
-        self.next_xlsx=dt.datetime.now()+dt.timedelta(hours=EXCEL_INT_H)
-        with RAW_CSV.open("a",newline="") as f:
-            w=csv.writer(f)
+        # producer: sample the PSU; rows are written by self.writer so CSV/xlsx
+        # I/O overlaps with the next VISA round trip
+        self._q=q=queue.Queue(maxsize=64)
+        self._wr=wr=threading.Thread(target=self.writer,args=(q,),daemon=True)
+        wr.start(); put=self._put
+        next_t=time.monotonic()
+        try:
             while not self.stop_evt.is_set():
+                period=self._period                   # live interval
                 now=dt.datetime.now(); rel=(now-self.t0).total_seconds()/3600
-                self.t.append(mdates.date2num(now))
-                for idx,ch in enumerate(range(1,5)):
-                    self.r[idx].append(safe_R(self.psu,ch)
-                                       if ch in chans else np.nan)
-                w.writerow([now.strftime("%Y-%m-%d %H:%M:%S"),
-                            f"{rel:.4f}"]+[ "" if np.isnan(self.r[i][-1])
-                                            else f"{self.r[i][-1]:.4f}"
-                                            for i in range(4)])
-                f.flush()
-                if now>=self.next_xlsx:
-                    csv_to_xlsx(RAW_CSV,excel)
-                    self.next_xlsx+=dt.timedelta(hours=EXCEL_INT_H)
-                time.sleep(self.sample_int.get())          # live interval
+                vals=safe_R(self.psu,chans)
+                self._append(datenum(now),vals)
+                put((now,rel,vals,period))
+                # deadline scheduling: no drift, missed slots are skipped
+                next_t+=period; late=time.monotonic()-next_t
+                if late>0: next_t+=(late//period+1)*period
+                self.stop_evt.wait(next_t-time.monotonic())
+        except Exception as e:
+            self.worker_err=e; raise
+        finally:
+            put(None); wr.join()                      # end of stream: drain
+
+    def _put(self,item):
+        """Queue item for the writer; False if the writer is not running."""
+        while self._wr is not None and self._wr.is_alive():
+            try: self._q.put(item,timeout=1); return True   # never block on
+            except queue.Full: pass                         # a dead writer
+        return False
+
+    def writer(self,q):
+        try: self._write_rows(q)
+        except Exception as e:          # e.g. disk full: stop sampling, tell GUI
+            self.worker_err=e; self.stop_evt.set(); raise
+
+    def _write_rows(self,q):
+        excel=self._excel()
+        self.next_xlsx=dt.datetime.now()+dt.timedelta(hours=EXCEL_INT_H)
+        with RAW_CSV.open("a",newline="",buffering=CSV_BUF) as f:
+            self._pending=0
+            try:
+                for item in iter(q.get,None):
+                    if isinstance(item,Future):     # Save XLSX request
+                        f.flush(); self._pending=0
+                        item.set_result(self.xlsx_pool.submit(csv_to_xlsx,RAW_CSV,excel))
+                        continue
+                    now,rel,vals,period=item
+                    f.write(ROW_FMT % (now.strftime("%Y-%m-%d %H:%M:%S"),rel,
+                                       *["" if math.isnan(v) else "%.4f"%v
+                                         for v in vals]))
+                    self._pending+=1
+                    if self._pending>=max(1,FLUSH_S//period):  # ≤1 min lost on crash
+                        f.flush(); self._pending=0
+                    if now>=self.next_xlsx:
+                        f.flush(); self._pending=0
+                        self.xlsx_pool.submit(csv_to_xlsx,RAW_CSV,excel)\
+                            .add_done_callback(report_failure)
+                        self.next_xlsx+=dt.timedelta(hours=EXCEL_INT_H)
+            finally:
+                f.flush(); os.fsync(f.fileno())
 
     # redraw ---------------------------------------------------------------
     def redraw(self):
-        if self.t:
-            now=mdates.date2num(dt.datetime.now()); cut=now-WINDOW_H/24
-            i0=next((i for i,tt in enumerate(self.t) if tt>=cut),len(self.t)-1)
-            x=np.array(list(self.t)[i0:])
-            live=[]
-            for idx,ln in enumerate(self.lines):
-                y=np.array(list(self.r[idx])[i0:],float); y[np.isinf(y)]=np.nan
-                ln.set_data(x,y)
-                v=y[-1] if len(y) else np.nan
-                live.append(f"CH{idx+1}: ---" if np.isnan(v)
-                            else f"CH{idx+1}: {v:.3f} Ω")
-            for txt,new in zip(self.leg.get_texts(),live): txt.set_text(new)
-            if len(x)>1: self.ax.set_xlim(x[0],x[-1])
-            self.canvas.draw_idle()
+        if self.worker_err is not None:         # logging thread died
+            err,self.worker_err=self.worker_err,None
+            self._teardown()
+            messagebox.showerror("Logging stopped",f"Logging failed: {err}")
+            return
+        if self.count:
+            t,r,fresh=self._series()                 # fresh: new sample arrived
+            now=datenum(dt.datetime.now()); cut=now-WINDOW_H/24
+            i0=min(int(np.searchsorted(t,cut,side="left")),len(t)-1)  # t is sorted
+            if fresh or i0!=self._shown_i0:   # else nothing visible changed
+                self._shown_i0=i0; x=t[i0:]
+                # ~2 vertices per pixel column is visually identical to all of them
+                stride=max(1,len(x)//max(1,int(2*self.ax.bbox.width)))
+                # keep the same samples tick to tick (absolute index % stride)
+                # and always the newest one
+                keep=np.arange((-(self._seq0+i0))%stride,len(x),stride)
+                if not len(keep) or keep[-1]!=len(x)-1: keep=np.append(keep,len(x)-1)
+                for idx,ln in enumerate(self.lines):
+                    ln.set_data(x[keep],r[idx,i0:][keep])
+                if fresh:
+                    for idx,(txt,v) in enumerate(zip(self.leg.get_texts(),r[:,-1]),1):
+                        txt.set_text(f"CH{idx}: ---" if np.isnan(v)
+                                     else f"CH{idx}: {v:.3f} Ω")
+                if len(x)>1: self.ax.set_xlim(x[0],x[-1])
+                self.canvas.draw_idle()
         if self.mode: self.after_id=self.after(1000,self.redraw)
 
     # start / stop --------------------------------------------------------
@@ -295,6 +440,7 @@ class App(tk.Tk):
         except Exception as e: messagebox.showerror("PSU",e); return False
         for ch in chans: chan_on(self.psu,ch,ilim)
         self.t0=dt.datetime.now(); self.mode=mode; self.stop_evt.clear()
+        self.worker_err=None
         self.thread=threading.Thread(target=self.worker,args=(chans,ilim),daemon=True)
         self.thread.start()
         if not self.after_id:
@@ -318,6 +464,9 @@ class App(tk.Tk):
     def stop_run(self):
         if not self.mode: return
         if not messagebox.askyesno("Stop","Stop current operation?"): return
+        self._teardown()
+
+    def _teardown(self):
         self.stop_evt.set(); self.thread.join()
         try:
             for ch in range(1,5): chan_off(self.psu,ch)
@@ -332,21 +481,24 @@ class App(tk.Tk):
 
     # misc buttons --------------------------------------------------------
     def save_xlsx(self):
-        excel=current_xlsx()
-        if excel is None:
-            excel=LOG_DIR/f"gpp_{dt.datetime.now():%Y%m%d_%H%M%S}.xlsx"
-            set_xlsx(excel)
-        csv_to_xlsx(RAW_CSV,excel)
+        # during a run the writer flushes its buffered rows before exporting
+        req=Future()
+        if self._put(req):
+            while self._wr.is_alive() and not wait([req],timeout=0.5).done: pass
+            if req.done(): req.result().result(); return
+        self.xlsx_pool.submit(csv_to_xlsx,RAW_CSV,self._excel()).result()
 
     def clear_cache(self):
         if not messagebox.askyesno("Clear","Delete raw cache?"): return
-        RAW_CSV.unlink(missing_ok=True); ensure_raw()
-        self.t.clear(); [q.clear() for q in self.r]; self.canvas.draw_idle()
+        RAW_CSV.unlink(missing_ok=True)
+        ensure_raw(); self._excel_path=None
+        self.head=self.count=0; self._cache_dirty=True; self.canvas.draw_idle()
 
     def quit_safe(self):
         if self.mode and not messagebox.askyesno("Quit","Stop current run and quit?"):
             return
         if self.mode: self.stop_run()
+        self.xlsx_pool.shutdown(wait=True)
         self.destroy()
 
 # ─ run ─